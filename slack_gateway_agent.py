@@ -1,22 +1,377 @@
 from strands import Agent
+from strands.models import BedrockModel
 from strands.tools.mcp import MCPClient
+from strands.types.exceptions import MCPClientInitializationError
 from bedrock_agentcore.runtime import BedrockAgentCoreApp
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import contextlib
+import json
 import logging
-from boto3.session import Session
+import time
+import httpx
 import os
+from urllib.parse import urlparse
 
 # MCPクライアント用のインポート
 from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.exceptions import McpError
 
 # AgentCore Identityからアクセストークンを取得する
 from bedrock_agentcore.identity.auth import requires_access_token
 
+__all__ = ["AgentWithIdentity", "app", "slack_agent"]
+
+# uvloopが利用可能であれば、より高速なイベントループを使用する
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-boto_session = Session()
-region = boto_session.region_name
+# DEBUG_STREAM=1 の場合のみストリーミングイベントを1件ずつログ出力する
+# ルートロガーはINFOのまま、このモジュールのロガーだけをDEBUGにする
+_DEBUG_STREAM = os.environ.get("DEBUG_STREAM") == "1"
+if _DEBUG_STREAM:
+    logger.setLevel(logging.DEBUG)
+
+def _resolve_region() -> Optional[str]:
+    """
+    AWSリージョンを解決する。
+    
+    AgentCore Runtimeでは環境変数が常に設定されているため、それを優先します。
+    設定されていない場合のみboto3のセッションから解決します。
+    
+    Returns:
+        Optional[str]: AWSリージョン名
+    """
+    env_region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
+    if env_region:
+        return env_region
+    from boto3.session import Session
+    return Session().region_name
+
+region = _resolve_region()
+
+# アクセストークンのキャッシュ
+# AgentWithIdentityインスタンスを跨いで再利用するため、モジュールレベルで保持する
+# キー: (workload_name, user_id, scope) / 値: (access_token, 有効期限のUNIX時刻)
+_TOKEN_CACHE: Dict[Tuple[str, str, str], Tuple[str, float]] = {}
+# 取得中のトークンリフレッシュ（キーごとに1つ）
+# 同時にキャッシュミスしたリクエストは同じタスクの完了を待つ
+_TOKEN_INFLIGHT: Dict[Tuple[str, str, str], "asyncio.Task[str]"] = {}
+# 有効期限の何秒前にトークンを再取得するか
+_TOKEN_EXPIRY_MARGIN_SECONDS = 30
+# JWTからexpを読み取れなかった場合のキャッシュ保持秒数
+_TOKEN_DEFAULT_TTL_SECONDS = 300
+
+# ストリーミングイベントのバッファサイズ
+# 呼び出し元への送信が遅れている間も、この件数まではBedrockからの受信を継続する
+_STREAM_BUFFER_SIZE = 32
+# ストリームの終端を示す番兵
+_STREAM_END = object()
+
+# 使用するBedrockのモデルID
+MODEL_ID = "us.anthropic.claude-sonnet-4-20250514-v1:0"
+
+# Bedrockモデルはimport時に一度だけ作成し、全てのAgentで共有する
+# （Agentごとにboto3クライアントを作成するコストを省く）
+# ログに出力するリージョンと実際に呼び出すリージョンを一致させるため、解決済みのリージョンを渡す
+_MODEL = BedrockModel(model_id=MODEL_ID, region_name=region)
+
+# エージェントのシステムプロンプト
+# 各ツールのパラメータや使い方はGateway側のツール定義（description / inputSchema）に記載し、
+# ここには役割とツール選択の方針のみを記載する（全てのLLM呼び出しに付与されるため）
+SYSTEM_PROMPT = """
+あなたは「Slack × Web検索（Tavily）」統合アシスタントです。
+- Slackに関する依頼（チャンネル一覧・投稿・履歴・ユーザー情報など）にはSlackツールを使う。
+- 情報探索・要約・比較にはTavilyを使う。URLが明示されていれば`extract`、なければ`search`を使う。
+- 複合依頼は「Tavilyで検索・要約 → Slackに投稿」「SlackからURLを取得 → `extract`で要約」のように順に実行し、結果を明確に報告する。
+- ツールの引数は各ツールのinputSchemaに従い、未定義の項目は渡さない。
+- 回答は要点→詳細の順に簡潔・丁寧にまとめ、Web情報には根拠URLを添える。不確実な点は推測せずその旨を明記する。
+"""
+
+
+def _get_token_expiry(access_token: str) -> float:
+    """JWTのペイロードからexpクレームを読み取り、有効期限を返す。
+
+    署名の検証はGateway側で行われるため、ここではデコードのみ行う。
+    デコードできない場合はデフォルトのTTLを使用する。
+
+    Args:
+        access_token: JWT形式のアクセストークン
+
+    Returns:
+        float: トークンの有効期限（UNIX時刻）
+    """
+    try:
+        payload_segment = access_token.split(".")[1]
+        # Base64URLのパディングを補完してからデコード
+        padded = payload_segment + "=" * (-len(payload_segment) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(padded))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError) as e:
+        logger.warning(f"トークンの有効期限を取得できませんでした: {e}")
+        return time.time() + _TOKEN_DEFAULT_TTL_SECONDS
+
+def _build_agent(tools: List[Any]) -> Agent:
+    """
+    共有のモデルとシステムプロンプトを使用してStrands Agentを作成する。
+    
+    既定のPrintingCallbackHandlerはテキストの差分ごとに標準出力へ書き込むため無効にし、
+    イベントの出力はDEBUG_STREAM有効時の_log_stream_eventのみで行う。
+    
+    Args:
+        tools: Agentに渡すツールのリスト
+        
+    Returns:
+        Agent: 作成したStrands Agent
+    """
+    return Agent(tools=tools, model=_MODEL, system_prompt=SYSTEM_PROMPT, callback_handler=None)
+
+async def _drain_stream(stream: AsyncGenerator[Any, None], queue: "asyncio.Queue[Any]") -> None:
+    """
+    ストリームのイベントをキューに積み、終了時に番兵を積む。
+    
+    キャンセルされた場合も含め、終了時にはストリームを必ず閉じる。
+    
+    Args:
+        stream: イベントを読み出す非同期ジェネレータ
+        queue: イベントを積むキュー
+    """
+    try:
+        async with contextlib.aclosing(stream):
+            async for event in stream:
+                await queue.put(event)
+    except asyncio.CancelledError:
+        # 呼び出し側が既に読み出しを止めているため、終端の通知は不要
+        raise
+    except Exception:
+        await queue.put(_STREAM_END)
+        raise
+    await queue.put(_STREAM_END)
+
+async def _buffer_stream(stream: AsyncGenerator[Any, None], maxsize: int = _STREAM_BUFFER_SIZE) -> AsyncIterator[Any]:
+    """
+    バックグラウンドのタスクでストリームを先読みし、上限付きのキュー経由でイベントを返す。
+    
+    呼び出し元への送信が一時的に遅れても、上流のストリームの受信が止まらないようにします。
+    キューが満杯になった場合は上流の読み出しを待機させ、背圧を維持します。
+    途中で閉じられた場合は、先読みのタスクと上流のストリームが終了するまで待ってから戻ります。
+    
+    Args:
+        stream: イベントを読み出す非同期ジェネレータ
+        maxsize: キューに保持するイベントの上限
+        
+    Yields:
+        ストリームのイベント（上流で発生した例外はそのまま送出）
+    """
+    queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=maxsize)
+    producer = asyncio.create_task(_drain_stream(stream, queue))
+    try:
+        while (event := await queue.get()) is not _STREAM_END:
+            yield event
+        # 上流で例外が発生していればここで送出される
+        await producer
+    finally:
+        producer.cancel()
+        # 上流のストリームを閉じ終えるまで待ち、呼び出し側がMCPセッションを解放した後に処理が続かないようにする
+        # （上流の例外は既に送出済みか、読み出しを止めた呼び出し側には不要なため無視する）
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await producer
+
+def _log_stream_event(event: Any) -> None:
+    """
+    デバッグ用にストリーミングイベントをログ出力する。
+    
+    ツール実行に関するイベントは内容が分かるメッセージで出力します。
+    ログ出力が無効な場合に整形コストがかからないよう、%形式の遅延フォーマットを使用します。
+    
+    Args:
+        event: エージェントからのストリーミングイベント
+    """
+    if isinstance(event, dict):
+        tool_info = event.get('current_tool_use')
+        if tool_info:
+            logger.debug("🔧 ツール実行中: %s", tool_info)
+            return
+        delta = event.get('delta')
+        if isinstance(delta, dict) and delta.get('toolUse'):
+            logger.debug("🚀 ツール呼び出し開始: %s", delta['toolUse'])
+            return
+        # 大きなペイロードをstr()で変換しないよう、文字列の場合のみ検査する
+        data = event.get('data')
+        if isinstance(data, str) and 'Tool #' in data:
+            logger.debug("📋 ツール情報: %s", data)
+            return
+    logger.debug("event=%r", event)
+
+def _list_all_tools(client: MCPClient) -> List[Any]:
+    """
+    ページネーションをサポートしてすべての利用可能なツールをリスト。
+    
+    Gatewayはページネーションされたレスポンスでツールを返す可能性があるため、
+    完全なリストを取得するためにページネーションを処理する必要があります。
+    MCPのtools/listはカーソル方式のため、次ページの取得には前ページの
+    pagination_tokenが必要であり、ページの並列取得はできません。
+    
+    Args:
+        client: MCPクライアントインスタンス
+        
+    Returns:
+        list: 利用可能なツールの完全なリスト
+    """
+    tools: List[Any] = []
+    pagination_token = None
+    
+    while True:
+        tmp_tools = client.list_tools_sync(pagination_token=pagination_token)
+        tools.extend(tmp_tools)
+        
+        pagination_token = tmp_tools.pagination_token
+        if pagination_token is None:
+            return tools
+
+# Gatewayへの接続で使用するHTTPコネクションプールの設定
+# MCPセッション内の複数のリクエストで同一のTCP/TLS接続を再利用する
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, keepalive_expiry=300)
+
+
+def _create_http_client(
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[httpx.Timeout] = None,
+    auth: Optional[httpx.Auth] = None,
+) -> httpx.AsyncClient:
+    """
+    MCPトランスポート用のhttpxクライアントを作成する。
+    
+    MCP SDKのデフォルトと同様にリダイレクトを追従し、加えてHTTP/2を有効にすることで
+    ツール呼び出しごとのリクエストを1本の接続上で多重化します。
+    
+    Args:
+        headers: すべてのリクエストに付与するヘッダー
+        timeout: リクエストのタイムアウト設定
+        auth: リクエストに適用するhttpx認証
+        
+    Returns:
+        httpx.AsyncClient: 設定済みのhttpxクライアント
+    """
+    return httpx.AsyncClient(
+        headers=headers,
+        timeout=timeout if timeout is not None else httpx.Timeout(30.0),
+        auth=auth,
+        follow_redirects=True,
+        http2=True,
+        limits=_HTTP_LIMITS,
+    )
+
+# MCPセッションの破棄が必要なエラー（Gatewayとの接続・MCPプロトコルに起因するもの）
+# Bedrockのスロットリングなど、セッションと無関係なエラーでは共有のセッションを破棄しない
+_MCP_SESSION_ERRORS = (httpx.TransportError, McpError, MCPClientInitializationError)
+
+# StrandsのMCPClientはツール呼び出し中の例外（セッション切れ・通信エラー・認証エラーなど）を
+# 送出せず、この文言で始まるエラーのツール結果に変換する
+# Slack APIのエラーなどGatewayが返したツールのエラーとは区別し、これだけをセッション破棄の対象とする
+_MCP_TOOL_FAILURE_PREFIX = "Tool execution failed"
+
+# MCPセッションを保持する最大秒数
+# 上記で検知できない切断からの復旧と、Gateway側のツール一覧の変更の反映のため定期的に張り直す
+_MCP_SESSION_MAX_AGE_SECONDS = 300
+
+
+def _is_mcp_client_alive(client: MCPClient) -> bool:
+    """
+    MCPクライアントのバックグラウンドスレッドが動作しているかを返す。
+    
+    Strandsはセッションの状態を公開APIで提供していないため、
+    内部の_is_session_active()（古いバージョンでは_background_thread）を参照する。
+    
+    Args:
+        client: 確認するMCPクライアント
+        
+    Returns:
+        bool: スレッドが動作していればTrue
+    """
+    is_session_active = getattr(client, "_is_session_active", None)
+    if callable(is_session_active):
+        return is_session_active()
+    background_thread = getattr(client, "_background_thread", None)
+    return background_thread is not None and background_thread.is_alive()
+
+def _has_mcp_tool_failure(event: Any) -> bool:
+    """
+    ストリーミングイベントに、MCPクライアント側で失敗したツール結果が含まれるかを返す。
+    
+    Args:
+        event: エージェントからのストリーミングイベント
+        
+    Returns:
+        bool: MCPセッションの異常を示すツール結果が含まれていればTrue
+    """
+    if not isinstance(event, dict):
+        return False
+    message = event.get('message')
+    if not isinstance(message, dict):
+        return False
+    for block in message.get('content') or []:
+        tool_result = block.get('toolResult') if isinstance(block, dict) else None
+        if not tool_result or tool_result.get('status') != 'error':
+            continue
+        for content in tool_result.get('content') or []:
+            text = content.get('text') if isinstance(content, dict) else None
+            if isinstance(text, str) and text.startswith(_MCP_TOOL_FAILURE_PREFIX):
+                return True
+    return False
+
+async def _stop_mcp_client(client: MCPClient) -> None:
+    """
+    MCPクライアントを停止する。失敗してもリクエストの処理は継続する。
+    
+    stop()はセッション終了のHTTPリクエストを含めバックグラウンドスレッドの終了を待つため、
+    イベントループを止めないようスレッドプールで実行する。
+    """
+    try:
+        await asyncio.to_thread(client.stop, None, None, None)
+    except Exception as e:
+        logger.warning(f"MCPセッションの終了に失敗: {e}")
+
+class _MCPSession:
+    """
+    ワーカーで保持するMCPセッションと、そのツールを使用中のリクエスト数。
+    
+    破棄が決まったセッション（retired）は、使用中のリクエストがなくなった時点で停止する。
+    """
+
+    def __init__(self, client: MCPClient, tools: List[Any]):
+        self.client = client
+        self.tools = tools
+        self.users = 0
+        self.retired = False
+        self.created_at = time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        """保持期間の上限を超えているかを返す。"""
+        return time.monotonic() - self.created_at > _MCP_SESSION_MAX_AGE_SECONDS
+
+class _BearerTokenAuth(httpx.Auth):
+    """
+    リクエストごとに最新のアクセストークンをAuthorizationヘッダーに設定するhttpx認証。
+    
+    MCPセッションを保持したままトークンを更新できるよう、
+    ヘッダーはトランスポートの作成時ではなくリクエストの送信時に組み立てる。
+    """
+
+    def __init__(self, access_token: str = ""):
+        self.access_token = access_token
+
+    def auth_flow(self, request: httpx.Request):
+        request.headers["Authorization"] = f"Bearer {self.access_token}"
+        yield request
 
 class AgentWithIdentity:
     """
@@ -36,9 +391,18 @@ class AgentWithIdentity:
         self.user_id = os.environ.get("USER_ID", "m2m-user-001")
         self.region = region
         
+        # ワーカーの存続期間中保持するMCPセッションとツール一覧
+        self._mcp_auth = _BearerTokenAuth()
+        self._mcp_session: Optional[_MCPSession] = None
+        self._mcp_lock = asyncio.Lock()
+        
         # 環境変数の検証
         if not self.gateway_url:
             raise ValueError("GATEWAY_URL環境変数が必要です")
+        self.gateway_url = self.gateway_url.strip()
+        parsed_gateway_url = urlparse(self.gateway_url)
+        if parsed_gateway_url.scheme not in ("http", "https") or not parsed_gateway_url.netloc:
+            raise ValueError(f"GATEWAY_URLが不正です（http(s)://から始まるURLを指定してください）: {self.gateway_url!r}")
         if not self.cognito_scope:
             raise ValueError("COGNITO_SCOPE環境変数が必要です")
             
@@ -48,12 +412,68 @@ class AgentWithIdentity:
         logger.info(f"User ID: {self.user_id}")
         logger.info(f"AWS Region: {self.region}")
 
+    @property
+    def _token_cache_key(self) -> Tuple[str, str, str]:
+        """トークンキャッシュのキーを返す。"""
+        return (self.workload_name, self.user_id, self.cognito_scope)
+
+    def _get_cached_token(self) -> Optional[str]:
+        """キャッシュ済みで有効期限に余裕のあるアクセストークンを返す。
+
+        Returns:
+            Optional[str]: 有効なキャッシュがあればアクセストークン、なければNone
+        """
+        cached = _TOKEN_CACHE.get(self._token_cache_key)
+        if cached and cached[1] - time.time() > _TOKEN_EXPIRY_MARGIN_SECONDS:
+            return cached[0]
+        return None
+
     async def get_access_token(self) -> str:
         """AgentCore Identityを使用してアクセストークンを取得する。
         
         Runtime環境では、runtimeUserIdはInvokeAgentRuntime API呼び出し時に
         システム側が設定し、Runtimeがエージェントに渡します。
         
+        取得したトークンは有効期限の少し前までキャッシュされ、
+        以降のリクエストではCognitoへの問い合わせを省略します。
+        
+        Returns:
+            str: 認証されたAPIコール用のアクセストークン
+        """
+
+        # キャッシュが有効ならそのまま返す
+        cached_token = self._get_cached_token()
+        if cached_token:
+            logger.info("♻️ キャッシュ済みのアクセストークンを使用")
+            return cached_token
+
+        # 他のリクエストが取得中であればそのタスクを待ち、なければ新たに取得を開始する
+        # （チェックから登録までの間にawaitを挟まないため、ロックは不要）
+        cache_key = self._token_cache_key
+        refresh_task = _TOKEN_INFLIGHT.get(cache_key)
+        if refresh_task is None:
+            refresh_task = asyncio.create_task(self._refresh_access_token())
+            _TOKEN_INFLIGHT[cache_key] = refresh_task
+            refresh_task.add_done_callback(lambda _: _TOKEN_INFLIGHT.pop(cache_key, None))
+        else:
+            logger.info("⏳ 他のリクエストによるアクセストークンの取得を待機中...")
+
+        # 待機中のリクエストがキャンセルされても、共有の取得処理は継続させる
+        return await asyncio.shield(refresh_task)
+
+    async def _refresh_access_token(self) -> str:
+        """アクセストークンを新規取得し、キャッシュに保存する。
+
+        Returns:
+            str: 認証されたAPIコール用のアクセストークン
+        """
+        access_token = await self._fetch_access_token()
+        _TOKEN_CACHE[self._token_cache_key] = (access_token, _get_token_expiry(access_token))
+        return access_token
+
+    async def _fetch_access_token(self) -> str:
+        """@requires_access_tokenデコレータ経由でアクセストークンを新規取得する。
+
         Returns:
             str: 認証されたAPIコール用のアクセストークン
         """
@@ -94,6 +514,113 @@ class AgentWithIdentity:
         # デコレータ付き関数を呼び出してトークンを取得
         return await _get_token()
     
+    def _create_streamable_http_transport(self):
+        """
+        Bearerトークン認証を使用したストリーミング可能なHTTPトランスポートを作成。
+        
+        このトランスポートは、MCPクライアントがGatewayへの認証された
+        リクエストを行うために使用されます。
+        Authorizationヘッダーはリクエストごとに_BearerTokenAuthから設定されるため、
+        トークンが更新されてもセッションを張り直す必要はありません。
+        """
+        logger.info(f"🔗 MCP transport作成中: {self.gateway_url}")
+        logger.info(f"🔑 トークンプレフィックス: {self._mcp_auth.access_token[:20]}...")
+        transport = streamablehttp_client(
+            self.gateway_url, 
+            auth=self._mcp_auth,
+            httpx_client_factory=_create_http_client,
+        )
+        logger.info("✅ MCP transport作成完了")
+        return transport
+
+    async def _acquire_mcp_session(self, access_token: str) -> _MCPSession:
+        """
+        GatewayとのMCPセッションを取得し、使用中として登録する。
+        
+        セッションとツール一覧はワーカーの存続期間中保持され、
+        2回目以降のリクエストではハンドシェイクとツール一覧の取得を省略します。
+        保持中のセッションが切断されている場合や、保持期間の上限を超えた場合は
+        破棄して張り直します。
+        使用後は必ず_release_mcp_sessionを呼び出してください。
+        
+        Args:
+            access_token: Gatewayへのリクエストに使用するアクセストークン
+            
+        Returns:
+            _MCPSession: 使用中として登録したMCPセッション
+        """
+        # 以降のGatewayへのリクエストは最新のトークンで認証する
+        self._mcp_auth.access_token = access_token
+
+        async with self._mcp_lock:
+            session = self._mcp_session
+            if session is not None and not _is_mcp_client_alive(session.client):
+                logger.warning("⚠️ MCPセッションが切断されているため、張り直します")
+                await self._retire_mcp_session(session)
+                session = None
+            elif session is not None and session.expired:
+                logger.info("MCPセッションの保持期間を超えたため、張り直します")
+                await self._retire_mcp_session(session)
+                session = None
+
+            if session is not None:
+                logger.info("♻️ 既存のMCPセッションを再利用します")
+            else:
+                session = await self._open_mcp_session()
+                self._mcp_session = session
+
+            session.users += 1
+            return session
+
+    async def _open_mcp_session(self) -> _MCPSession:
+        """
+        MCPクライアントを起動し、利用可能なツールの一覧を取得する。
+        
+        Returns:
+            _MCPSession: 新しく確立したMCPセッション
+        """
+        logger.info("ステップ2: 認証されたMCPクライアントでセッションを確立中...")
+        mcp_client = MCPClient(self._create_streamable_http_transport)
+        # start()とlist_tools_sync()はMCPのバックグラウンドスレッドの完了を同期的に待つため、
+        # イベントループを止めないようスレッドプールで実行する
+        await asyncio.to_thread(mcp_client.start)
+        try:
+            # ステップ3: 認証された接続を通じて利用可能なツールをリスト
+            logger.info("ステップ3: 認証されたMCPクライアント経由で利用可能なツールをリスト中...")
+            tools = await asyncio.to_thread(_list_all_tools, mcp_client)
+            # Strandsのツール（MCPAgentTool）は常にtool_nameを持つ
+            # INFOログが無効な場合は一覧の組み立て自体を省略する
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("利用可能なツール: %s", [tool.tool_name for tool in tools])
+
+            if not tools:
+                raise RuntimeError("Gatewayから利用可能なツールがありません")
+        except Exception:
+            await _stop_mcp_client(mcp_client)
+            raise
+
+        return _MCPSession(mcp_client, tools)
+
+    async def _release_mcp_session(self, session: _MCPSession) -> None:
+        """_acquire_mcp_sessionで取得したセッションの使用終了を記録する。"""
+        session.users -= 1
+        if session.retired and session.users == 0:
+            await _stop_mcp_client(session.client)
+
+    async def _retire_mcp_session(self, session: _MCPSession) -> None:
+        """
+        MCPセッションを破棄し、次回のリクエストで再接続させる。
+        
+        他のリクエストがまだツールを使用中の場合、停止はその使用終了まで延期する。
+        """
+        if self._mcp_session is session:
+            self._mcp_session = None
+        if session.retired:
+            return
+        session.retired = True
+        if session.users == 0:
+            await _stop_mcp_client(session.client)
+
     async def access_to_slack(self, payload: Dict[str, Any]):
         """
         完全なフロー: トークン取得 → エージェント作成 → ストリーミングでSlackワークスペースにアクセス。
@@ -114,184 +641,92 @@ class AgentWithIdentity:
         logger.info(f"Runtimeが自動的にruntimeUserIdを渡します")
         
         access_token = await self.get_access_token()
+        yield {"status": "authenticated"}
         
-        # ステップ2: 認証されたMCPクライアントでエージェントを作成
-        logger.info("ステップ2: 認証されたMCPクライアントでエージェントを作成中...")
-
-        def create_streamable_http_transport():
-            """
-            Bearerトークン認証を使用したストリーミング可能なHTTPトランスポートを作成。
-            
-            このトランスポートは、MCPクライアントがGatewayへの認証された
-            リクエストを行うために使用されます。
-            """
-            logger.info(f"🔗 MCP transport作成中: {self.gateway_url}")
-            logger.info(f"🔑 トークンプレフィックス: {access_token[:20]}...")
-            transport = streamablehttp_client(
-                self.gateway_url, 
-                headers={"Authorization": f"Bearer {access_token}"}
-            )
-            logger.info("✅ MCP transport作成完了")
-            return transport
-        
-        def get_full_tools_list(client):
-            """
-            ページネーションをサポートしてすべての利用可能なツールをリスト。
-            
-            Gatewayはページネーションされたレスポンスでツールを返す可能性があるため、
-            完全なリストを取得するためにページネーションを処理する必要があります。
-            
-            Args:
-                client: MCPクライアントインスタンス
-                
-            Returns:
-                list: 利用可能なツールの完全なリスト
-            """
-            more_tools = True
-            tools = []
-            pagination_token = None
-            
-            while more_tools:
-                tmp_tools = client.list_tools_sync(pagination_token=pagination_token)
-                tools.extend(tmp_tools)
-                
-                if tmp_tools.pagination_token is None:
-                    more_tools = False
-                else:
-                    more_tools = True 
-                    pagination_token = tmp_tools.pagination_token
-            return tools
-        
-        # 認証されたトランスポートでMCPクライアントを作成
-        mcp_client = MCPClient(create_streamable_http_transport)
-
+        session: Optional[_MCPSession] = None
         try:
-            with mcp_client:
-                # ステップ3: 認証された接続を通じて利用可能なツールをリスト
-                logger.info("ステップ3: 認証されたMCPクライアント経由で利用可能なツールをリスト中...")
-                tools = get_full_tools_list(mcp_client)
-                # MCPツールの属性名を確認してからログ出力
-                try:
-                    tools_names = [getattr(tool, 'tool_name', getattr(tool, 'name', str(tool))) for tool in tools]
-                except Exception as e:
-                    logger.warning(f"ツール名の取得に失敗: {e}")
-                    tools_names = [str(tool) for tool in tools]
-                logger.info(f"利用可能なツール: {tools_names}")
-
-                if not tools:
-                    raise RuntimeError("Gatewayから利用可能なツールがありません")
-                
-                # ステップ4: 認証されたツールでエージェントを作成
-                logger.info("ステップ4: 認証されたツールでStrands Agentを作成中...")
-                agent = Agent(
-                    tools=tools,
-                    model="us.anthropic.claude-sonnet-4-20250514-v1:0",
-                    system_prompt=
-                    """
-                    あなたは「Slack × Web検索（Tavily）」統合アシスタントです。
-
-                    【あなたができること】
-                    - Slack 操作
-                      - チャンネル一覧の取得・検索・ページング
-                      - メッセージ送信（チャンネル/スレッド）
-                      - 履歴・スレッドの取得
-                      - ユーザー情報の確認
-                    - Web 検索（Tavily）
-                      - 指定クエリの検索・要約
-                      - ニュース/技術情報の収集と根拠URLの提示
-
-                    【ツール選択の方針】
-                    - ユーザーが Slack に関する意図を述べたら Slack ツールを使う。
-                      - 例：「チャンネル一覧」「このチャンネルに投稿」「履歴を取得」など
-                    - 情報探索・要約・比較などは Tavily を使う。
-                      - 例：「最近の動向を調べて」「このトピックの要点をまとめて」など
-                    - 複合依頼（例：「Webで調べて Slack に投稿」）は
-                      1) Tavily で検索・要約 → 2) Slack で投稿、の順に実行し結果を明確に報告する。
-                      1) SlackからURLを取得 → 2) Tavilyで`extract`ツールを用いて要約し、その結果を返す
-
-                    【Slack ツール利用ルール】
-                    - 利用可能な Slack ツール名は tool_config の一覧（tools/list）に従う。
-                      - 代表例：`conversationsList`, `conversationsHistory`, `conversationsReplies`,
-                        `chatPostMessage`, `usersList` など（接頭辞は環境に依存）。
-                    - `conversationsList`:
-                      - 既定: `types="public_channel"`, `exclude_archived=true`, `limit=100`
-                      - ページング: `response_metadata.next_cursor` があれば `cursor` を付けて再取得。必要ページ数だけ繰り返す。
-                    - `chatPostMessage`:
-                      - 既定: `as_user=false` は環境に依存。`channel` と `text` を必須で渡す。
-                      - 返信は `thread_ts` を指定。
-                    - 発言時の表現は簡潔・丁寧に。長文は要点→詳細の順に整える。
-                    - 権限やインストール状況に依存する操作（私有チャンネル等）は、権限不足時に分かりやすく案内する。
-
-                    【Tavily ツール利用ルール】
-                    - 利用可能な Tavily ツール名は tool_config の一覧に従う（例：`search`）。
-                    - `search`:
-                      - 必須: `query`（ユーザー意図を的確な検索クエリに言い換えて渡す）
-                      - 任意: `search_depth` は既定で `"basic"`。深掘りが必要なら `"advanced"` を使う。
-                    - 検索結果の提示:
-                      - まず結論/要点を箇条書き → 続いて根拠URL（3〜5件）を列挙。
-                      - 日付が重要な話題は発見日時・記事日付を明記。
-                      - 不確実な点はその旨を明記して推測を書かない。
-
-                    - `extract`:
-                      - 用途: 指定された **単一URL** の本文を抽出して要約する（検索は行わない）。
-                      - 必須: `url`（`https://` から始まる完全なURLを渡す）。
-                      - 任意: 追加パラメータは **tool_config の inputSchema に厳密に従う**（未定義の項目は渡さない）。
-                      - 入力バリデーション:
-                        - リダイレクトや短縮URLは最終到達先を想定して扱う。`javascript:` やファイルスキームは拒否。
-                      - 出力フォーマット（推奨）:
-                        - 1行目: 記事タイトル（あれば）/ 発行日（判明時はISO形式）。
-                        - 続けて要点を箇条書き（3〜5項目、数値やスコアは明示）。
-                        - 最後に `出典: <URL>` を添える。引用は必要最小限で、自分の言葉で要約する。
-                      - 使い分け:
-                        - ユーザーが明示的にURLを提示したら **`extract` を優先**。
-                        - サイト内を横断したい/URLが分からないなら `search` を使い、必要に応じて見つけたURLへ `extract` を連鎖実行する。
-                    ユーザーの意図を正しく読み取り、適切なツールを選択し、明確で実用的な結果を返してください。
-                    """
-                )
+            # ステップ2: 認証されたMCPクライアントのセッションを確立（既存セッションがあれば再利用）
+            session = await self._acquire_mcp_session(access_token)
+            
+            # ステップ4: 認証されたツールでエージェントを作成
+            logger.info("ステップ4: 認証されたツールでStrands Agentを作成中...")
+            try:
+                # Agentは会話履歴やメトリクスなど実行ごとの状態を持つため、リクエストごとに作成する
+                # （モデルとシステムプロンプトは共有のため、作成コストは小さい）
+                agent = _build_agent(session.tools)
 
                 # ステップ5: ストリーミングでSlackワークスペースにアクセス
                 logger.info("ステップ5: ストリーミングでSlackワークスペースにアクセス中...")
                 # ユーザーメッセージを取得
                 user_message = payload.get("prompt", "")
                 logger.info(f"ユーザーメッセージ: {user_message}")
-                
+            
                 # ストリーミングレスポンスを使用
-                agent_stream = agent.stream_async(user_message)
-                
-                # ストリーミングイベントをyieldで返す
-                async for event in agent_stream:
-                    # デバッグ用：ツール実行に関するイベントをログ出力
-                    # if isinstance(event, dict):
-                    #     if event.get('current_tool_use'):
-                    #         tool_info = event.get('current_tool_use')
-                    #         logger.info(f"🔧 ツール実行中: {tool_info}")
-                    #     elif event.get('delta') and event['delta'].get('toolUse'):
-                    #         logger.info(f"🚀 ツール呼び出し開始: {event['delta']['toolUse']}")
-                    #     elif 'data' in event and 'Tool #' in str(event.get('data', '')):
-                    #         logger.info(f"📋 ツール情報: {event['data']}")
-                    print(event)
-                    yield event
-                    
-                logger.info(f"Slackへのアクセス完了")
+                # 呼び出し元への送信とBedrockからの受信を切り離すため、バッファ経由で読み出す
+                # 呼び出し元が切断した場合も、MCPセッションを解放する前にストリームを確実に閉じる
+                async with contextlib.aclosing(_buffer_stream(agent.stream_async(user_message))) as agent_stream:
+                    # ストリーミングイベントをyieldで返す
+                    async for event in agent_stream:
+                        # デバッグ用：ストリーミングイベントをログ出力
+                        if _DEBUG_STREAM:
+                            _log_stream_event(event)
+                        if not session.retired and _has_mcp_tool_failure(event):
+                            # ツール呼び出しでMCPセッションの異常を検知したため、次のリクエストで張り直す
+                            logger.warning("⚠️ ツール呼び出しでMCPセッションの異常を検知しました")
+                            await self._retire_mcp_session(session)
+                        yield event
+            finally:
+                await self._release_mcp_session(session)
+
+            logger.info(f"Slackへのアクセス完了")
                 
+        except (TimeoutError, asyncio.TimeoutError, httpx.TimeoutException) as e:
+            # 想定内のタイムアウトはトレースバックを整形せずに返す
+            logger.error("⏱️ 読み取りタイムアウトを検出: %s", e)
+            if session is not None and isinstance(e, _MCP_SESSION_ERRORS):
+                await self._retire_mcp_session(session)
+            yield {"error": f"Gateway応答タイムアウト: {str(e)}"}
+
         except Exception as e:
-            import traceback
-            error_trace = traceback.format_exc()
-            logger.error(f"❌ エージェント実行中のエラー: {e}")
-            logger.error(f"📊 エラーの詳細トレース:\n{error_trace}")
+            # トレースバックはハンドラが出力する場合のみ整形される
+            logger.exception("❌ エージェント実行中のエラー: %s", e)
+            
+            # Gatewayとの接続に起因するエラーの場合のみ、次のリクエストでMCPセッションを張り直す
+            if session is not None and isinstance(e, _MCP_SESSION_ERRORS):
+                await self._retire_mcp_session(session)
             
             # エラーメッセージの詳細分析
             error_msg = str(e).lower()
+            # GATEWAY_URLは初期化時に検証済みのため、ここではタイムアウトのみ判別する
             if "read timeout" in error_msg:
-                if "none" in error_msg:
-                    logger.error("🔍 URLがNoneになっている問題を検出")
-                    yield {"error": f"Gateway URL設定エラー: {str(e)}"}
-                else:
-                    logger.error("⏱️ 読み取りタイムアウトを検出")
-                    yield {"error": f"Gateway応答タイムアウト: {str(e)}"}
+                logger.error("⏱️ 読み取りタイムアウトを検出")
+                yield {"error": f"Gateway応答タイムアウト: {str(e)}"}
             else:
                 yield {"error": f"エージェントの実行に失敗しました: {str(e)}"}
 
+# AgentWithIdentityはimport時に一度だけ作成し、全リクエストで再利用する
+# 環境変数が不足している場合はエラーを最初のリクエストまで遅延させる
+_AGENT_IDENTITY: Optional[AgentWithIdentity] = None
+try:
+    _AGENT_IDENTITY = AgentWithIdentity()
+except ValueError as e:
+    logger.warning(f"AgentWithIdentityの初期化を最初のリクエストまで延期します: {e}")
+
+
+def _get_agent_identity() -> AgentWithIdentity:
+    """共有のAgentWithIdentityインスタンスを返す。
+
+    import時に作成できなかった場合はここで再度作成を試み、
+    失敗した場合は例外をそのまま送出する。
+
+    Returns:
+        AgentWithIdentity: 全リクエストで共有するインスタンス
+    """
+    global _AGENT_IDENTITY
+    if _AGENT_IDENTITY is None:
+        _AGENT_IDENTITY = AgentWithIdentity()
+    return _AGENT_IDENTITY
+
 # AgentCoreアプリケーションを初期化
 app = BedrockAgentCoreApp()
 
@@ -305,11 +740,15 @@ async def slack_agent(payload: Dict[str, Any]):
     
     Yields:
         AgentCore Runtime形式のストリーミングレスポンス
+        （最初に{"status": "starting"}、認証後に{"status": "authenticated"}を返す）
     """
     
+    # 最初のイベントを即座に返し、準備処理の間も呼び出し元へのレスポンスを開始しておく
+    yield {"status": "starting"}
+    
     try:
-        # AgentWithIdentityインスタンスを作成
-        agent_with_identity = AgentWithIdentity()
+        # 共有のAgentWithIdentityインスタンスを取得
+        agent_with_identity = _get_agent_identity()
     except ValueError as e:
         # 環境変数が設定されていない場合のエラー
         logger.error(f"設定エラー: {e}")